@@ -1,13 +1,64 @@
 import json
+import hashlib
+import os
 from pathlib import Path
 import pandas as pd
 import time
+import random
 import zipfile
-import io
+import tempfile
 import requests
 from datetime import datetime
-
-from .usa_types import AwardType, DATA_FOLDER, SPENDING_BY_AWARD, AWARD_DOWNLOAD, award_type_codes, program_activity_codes
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
+from functools import lru_cache
+from contextlib import contextmanager
+import pyarrow.lib
+import pyarrow.compute as pc
+
+from .usa_types import AwardType, DATA_FOLDER, SPENDING_BY_AWARD, AWARD_DOWNLOAD, award_type_codes, program_activity_codes, api_session, RateLimiter, atomic_file, cache_is_fresh, clear_stale_files
+
+
+# the columns that we ask for in the table of awards, for every award type
+_BASE_SEARCH_FIELDS = (
+    "generated_internal_id",
+    "prime_award_recipient_id",
+    "def_codes",
+    "Award ID",
+    "Recipient Name",
+    "Recipient DUNS Number",
+    "recipient_id",
+    "Base Obligation Date",
+    "Recipient Location",
+    "Awarding Agency",
+    "Awarding Agency Code",
+    "Awarding Sub Agency",
+    "Awarding Sub Agency Code",
+    "Contract Award Type",
+    "Award Type",
+    "Funding Agency",
+    "Funding Agency Code",
+    "Funding Sub Agency",
+    "Funding Sub Agency Code",
+    "Description",
+)
+
+# the full list of columns for each award type. these never change, so build them once instead of every time we ask for a page
+_AWARD_SEARCH_FIELDS: dict[AwardType, tuple[str, ...]] = {
+    AwardType.CONTRACT: _BASE_SEARCH_FIELDS + ("Start Date", "End Date", "Award Amount", "Total Outlays", "Contract Award Type"),
+    AwardType.IDV: _BASE_SEARCH_FIELDS + ("Start Date", "Award Amount", "Total Outlays", "Contract Award Type", "Last Date to Order", "NAICS", "PSC"),
+    AwardType.LOAN: _BASE_SEARCH_FIELDS + ("Issued Date", "Loan Value", "Subsidy Cost", "SAI Number", "CFDA Number", "Assistance Listings", "primary_assistance_listing"),
+    AwardType.GRANT: _BASE_SEARCH_FIELDS + ("Start Date", "End Date", "Award Amount", "Total Outlays", "Award Type", "SAI Number", "CFDA Number", "Assistance Listings", "primary_assistance_listing"),
+    AwardType.DIRECT_PAYMENTS: _BASE_SEARCH_FIELDS + ("Start Date", "End Date", "Award Amount", "Total Outlays", "Award Type", "SAI Number", "CFDA Number", "Assistance Listings", "primary_assistance_listing"),
+    AwardType.OTHER: _BASE_SEARCH_FIELDS + ("Start Date", "End Date", "Award Amount", "Total Outlays", "Award Type", "SAI Number", "CFDA Number", "Assistance Listings", "primary_assistance_listing"),
+}
+
+
+@lru_cache(maxsize = 4)
+def _load_json(file: str, modified_time: int) -> dict:
+    """Load a json file that we read many times without changing it. The modification time is part of the cache key, so if the file gets rewritten, we load it again. Don't modify the result, because it is shared between calls."""
+    with open(file) as f:
+        return json.load(f)
 
 
 class AwardSearchDownload:
@@ -21,6 +72,31 @@ class AwardSearchDownload:
 
     valid_file_tags = ["FederalAccountFunding", "TransactionHistory", "Sub-Awards"]
     award_types = [AwardType.CONTRACT, AwardType.IDV, AwardType.LOAN, AwardType.GRANT, AwardType.DIRECT_PAYMENTS, AwardType.OTHER]
+    search_page_window = 5  # how many pages of the awards table to ask for at the same time
+    search_requests_per_second = 5  # how fast we ask the API for pages of the awards table, so we don't get locked out for making too many requests in a row
+    search_cache_seconds = 60 * 60  # how long a saved page of award search results stays good
+    award_download_workers = 10  # most awards to request and watch at the same time
+    zip_memory_limit = 32 * 1024 * 1024  # bytes of a downloaded zip file to keep in memory before spilling it to disk. several downloads run at once, so keep this modest
+    poll_delay = 2.0  # seconds to wait before checking on a pending download again. this grows after every check
+    max_poll_delay = 30.0  # the longest we'll wait between checks on a pending download
+    # column types that we already know for the downloaded csvs, so pandas doesn't have to guess them from the data. the TAS columns are always read as text so we can search them
+    tag_dtypes = {
+        "FederalAccountFunding": {
+            "treasury_account_symbol": "str",
+            "submission_period": "str",
+            "object_class_code": "float64",
+            "transaction_obligated_amount": "float64",
+            "gross_outlay_amount_FYB_to_period_end": "float64",
+        },
+        "TransactionHistory": {"treasury_accounts_funding_this_award": "str"},
+        "Sub-Awards": {"prime_award_treasury_accounts_funding_this_award": "str"},
+    }
+    # columns that almost identify a row in the downloaded csvs. two rows can only be duplicates if they match on these, so we only compare whole rows when they do
+    tag_key_columns = {
+        "FederalAccountFunding": ["award_unique_key", "submission_period", "object_class_code", "transaction_obligated_amount"],
+        "TransactionHistory": ["contract_transaction_unique_key", "assistance_transaction_unique_key"],
+        "Sub-Awards": ["prime_award_unique_key", "subaward_number"],
+    }
 
     def __init__(
             self,
@@ -42,7 +118,19 @@ class AwardSearchDownload:
             self.critical_download_date = critical_download_date
         else:
             self.critical_download_date = None
+        self._time_dict: dict | None = None  # contents of downloaded.json, loaded the first time we need them
+        self._batching_times = False  # true while we hold off on writing downloaded.json, see _batched_time_writes
+        self._unsaved_times = False  # true if we updated a time while holding off on writing downloaded.json
+        self._award_ids_cache: tuple | None = None  # award ids from the award json, with the file's modified time and size when we read it. see generated_award_ids
+        self._url_index_lock = threading.Lock()  # award downloads run on several threads, and they all write to the same url index
+        self._search_rate = RateLimiter(self.search_requests_per_second)  # search pages are requested on several threads, and they all share the same rate limit
+
+        # reuse the connections to the API instead of opening a new one every time. download requests start a job on the server, so this session never retries a POST
+        self.session = api_session()
+        # the award searches only read data, so these can retry their POSTs when the API is busy
+        self.search_session = api_session(retry_posts = True)
         self.create_folders()
+        clear_stale_files(self.search_cache_folder(), self.search_cache_seconds)
 
     def run_all(self):
         print(f"Downloading all for {self.summary_name}")
@@ -56,9 +144,9 @@ class AwardSearchDownload:
 
     def create_folders(self):
         # create the folders where we are going to save our data
-        for folder in [self.summary_data_folder(), self.summary_folder(), self.downloads_folder(), self.pending_downloads_folder()]:
-            if not folder.exists():
-                folder.mkdir()
+        for folder in [self.summary_data_folder(), self.summary_folder(), self.downloads_folder(), self.pending_downloads_folder(), self.search_cache_folder()]:
+            # exist_ok instead of checking first, so two downloads starting at once can't both try to create the same folder
+            folder.mkdir(parents = True, exist_ok = True)
 
     def summary_data_folder(self) -> Path:
         return DATA_FOLDER / "summaries"
@@ -84,6 +172,10 @@ class AwardSearchDownload:
         """Folder that holds info about award folder downloads that we've requested, that the API is still working on."""
         return DATA_FOLDER / "pending_downloads"
 
+    def search_cache_folder(self) -> Path:
+        """Folder that holds the pages of award search results that we got recently, so a search that fails partway can pick up where it left off. The transaction search keeps its pages in its own folder next to this one."""
+        return DATA_FOLDER / "search_cache" / "awards"
+
     def award_json(self) -> Path:
         """File where we will save the list of awards relevant to this TAS code."""
         return self.summary_folder() / f"awards_{self.summary_name}.json"
@@ -93,6 +185,10 @@ class AwardSearchDownload:
         if tag not in self.valid_file_tags:
             raise ValueError(f"No file found named {tag}")
         return self.summary_folder() / f"combined_{tag}_{self.summary_name}.csv"
+
+    def combined_parquet(self, tag: str) -> Path:
+        """Parquet copy of the combined csv. It keeps the column types and loads much faster than the csv, so we read it back when checking the sums."""
+        return self.combined_csv(tag).with_suffix(".parquet")
     
     def check_overwrite(self, filename: Path) -> bool:
         """Get the time when the requested file was downloaded, and return true if we should overwrite the file.
@@ -112,8 +208,7 @@ class AwardSearchDownload:
         if self.critical_download_date is None:
             # we have no critical download date. don't overwrite it
             return False
-        with open(time_file) as f:
-            time_dict = json.load(f)
+        time_dict = self._load_times()
         file_str = filename.name
         if file_str not in time_dict:
             # we didn't write down when we made the file. overwrite it
@@ -126,17 +221,42 @@ class AwardSearchDownload:
             # we downloaded this before the critical download date. overwrite it.
             return True
     
+    def _load_times(self) -> dict:
+        """Get the dict of when we made each file, from downloaded.json. We read the file the first time we need it, then keep the dict in memory and update it there."""
+        if self._time_dict is None:
+            time_file = self.summary_downloaded_file()
+            if not time_file.exists():
+                self._time_dict = {}
+            else:
+                with open(time_file) as f:
+                    self._time_dict = json.load(f)
+        return self._time_dict
+
     def export_downloaded_time(self, file: Path):
         """Export the current time as the time when we downloaded this file."""
-        time_file = self.summary_downloaded_file()
-        if not time_file.exists():
-            time_dict = {}
-        else:
-            with open(time_file) as f:
-                time_dict = json.load(f)
+        time_dict = self._load_times()
         time_dict[file.name] = datetime.now().isoformat()
-        with open(time_file, "w") as f:
-            json.dump(time_dict, f, indent = 4)
+        if self._batching_times:
+            self._unsaved_times = True
+        else:
+            self._save_times()
+
+    def _save_times(self):
+        """Write the dict of when we made each file to downloaded.json."""
+        with atomic_file(self.summary_downloaded_file()) as temp_file, open(temp_file, "w") as f:
+            json.dump(self._load_times(), f, indent = 4)
+
+    @contextmanager
+    def _batched_time_writes(self):
+        """Inside this block, export_downloaded_time only updates the dict in memory, and we write downloaded.json once at the end. It still gets written if something goes wrong partway, so the files we finished keep their times."""
+        self._batching_times = True
+        self._unsaved_times = False
+        try:
+            yield
+        finally:
+            self._batching_times = False
+            if self._unsaved_times:
+                self._save_times()
 
     # -- Downloading summary
 
@@ -151,54 +271,57 @@ class AwardSearchDownload:
         if not overwrite:
             return
 
+        # old fiscal years almost never change. if we downloaded them before, ask the API to only send them again if they changed
+        previous = self.import_program_activity()
+        validators = self._load_http_validators()
         out = {}
         for fiscal_year in self.fiscal_year_range():
             url = f"https://api.usaspending.gov/api/v2/agency/treasury_account/{self.tas_code}/program_activity?fiscal_year={fiscal_year}"
-            response = requests.get(url).json()
+            headers = {}
+            if str(fiscal_year) in previous and url in validators:
+                if "etag" in validators[url]:
+                    headers["If-None-Match"] = validators[url]["etag"]
+                if "last_modified" in validators[url]:
+                    headers["If-Modified-Since"] = validators[url]["last_modified"]
+            res = self.session.get(url, headers = headers)
+            if res.status_code == 304:
+                # nothing changed since last time. keep what we already have
+                out[fiscal_year] = previous[str(fiscal_year)]
+                continue
+            response = res.json()
             out[fiscal_year] = response.get("results", {})
 
+            # remember the tags the API gave us for this year, so we can ask if it changed next time
+            validators[url] = {}
+            if "ETag" in res.headers:
+                validators[url]["etag"] = res.headers["ETag"]
+            if "Last-Modified" in res.headers:
+                validators[url]["last_modified"] = res.headers["Last-Modified"]
+
         # export the results and save the time when we exported them
         with open(filename, "w") as f:
             json.dump(out, f, indent = 4)
+        with open(self.http_validators_file(), "w") as f:
+            json.dump(validators, f, indent = 4)
         self.export_downloaded_time(filename)
 
+    def http_validators_file(self) -> Path:
+        """File where we save the ETag and Last-Modified headers the API sent for each program activity url."""
+        return self.summary_folder() / "http_validators.json"
+
+    def _load_http_validators(self) -> dict[str, dict]:
+        """Import the saved ETag and Last-Modified headers as a dictionary keyed by url."""
+        validators_file = self.http_validators_file()
+        if not validators_file.exists():
+            return {}
+        with open(validators_file) as f:
+            return json.load(f)
+
     # -- Searching for awards
      
     def _award_search_fields(self, award_type: AwardType) -> list[str]:
         """A list of column names to include in the table of awards that we're requesting from the API."""
-        base_fields = [
-            "generated_internal_id",
-            "prime_award_recipient_id",
-            "def_codes",
-            "Award ID",
-            "Recipient Name",
-            "Recipient DUNS Number",
-            "recipient_id",
-            "Base Obligation Date",
-            "Recipient Location",
-            "Awarding Agency",
-            "Awarding Agency Code",
-            "Awarding Sub Agency",
-            "Awarding Sub Agency Code",
-            "Contract Award Type",
-            "Award Type",
-            "Funding Agency",
-            "Funding Agency Code",
-            "Funding Sub Agency",
-            "Funding Sub Agency Code",
-            "Description",
-        ]
-        if award_type == AwardType.CONTRACT:
-            fields = ["Start Date", "End Date", "Award Amount", "Total Outlays", "Contract Award Type"]
-        elif award_type == AwardType.IDV:
-            fields = ["Start Date", "Award Amount", "Total Outlays", "Contract Award Type", "Last Date to Order", "NAICS", "PSC"]
-        elif award_type == AwardType.LOAN:
-            fields = ["Issued Date", "Loan Value", "Subsidy Cost", "SAI Number", "CFDA Number", "Assistance Listings", "primary_assistance_listing"]
-        elif award_type in [AwardType.GRANT, AwardType.DIRECT_PAYMENTS, AwardType.OTHER]:
-            fields =  ["Start Date", "End Date", "Award Amount", "Total Outlays", "Award Type", "SAI Number", "CFDA Number", "Assistance Listings", "primary_assistance_listing"]
-        else:
-            fields = []
-        return base_fields + fields
+        return list(_AWARD_SEARCH_FIELDS.get(award_type, _BASE_SEARCH_FIELDS))
     
     def _tas_filter(self) -> dict:
         """A dictionary that we pass in as an argument to the USASpending API to look for this TAS code."""
@@ -238,10 +361,19 @@ class AwardSearchDownload:
         """
         # get the arguments to pass into the API
         kwargs = self._award_search_filter(page = page, award_type = award_type)
+
+        # use the page we saved if we asked for the exact same thing recently, e.g. if the last search failed partway through
+        cache_file = self.search_cache_folder() / f"{hashlib.sha1(json.dumps(kwargs, sort_keys = True).encode()).hexdigest()}.json"
+        # a critical download date means we want results from after it, so pages saved before it don't count, no matter how recent
+        if cache_is_fresh(cache_file, self.search_cache_seconds, self.critical_download_date):
+            with open(cache_file) as f:
+                cached = json.load(f)
+            return cached["results"], cached["has_next"]
         print(f"Looking up awards for {award_type.name}, page {page}")
 
-        # ask the API for the information
-        retval = requests.post(SPENDING_BY_AWARD, json = kwargs)
+        # ask the API for the information, once it's our turn
+        self._search_rate.wait()
+        retval = self.search_session.post(SPENDING_BY_AWARD, json = kwargs)
 
         # raise an error if the lookup failed
         retval.raise_for_status()
@@ -254,29 +386,39 @@ class AwardSearchDownload:
 
         # pull out the list of table rows
         results: list[dict] = res["results"]
+
+        # save the page
+        with atomic_file(cache_file) as temp_file, open(temp_file, "w") as f:
+            f.write(json.dumps({"results": results, "has_next": has_next}))
         return results, has_next
 
     def _search_award_type(self, award_type: AwardType) -> dict:
         """Get a dict of awards for TAS codes and add them to the dict. If there are a lot of awards, the API won't let us ask for a huge table all at once. Instead, we have to break up that table into groups of 100, and ask it for results 1-100, then 101-200, then 201-300, etc. Each time we ask for those results, it will tell us if there are more pages of results.
             
         Output: a dictionary where the keys are long award IDs, and the values are dictionaries that represent rows in the awards table."""
+        # get the first page of up to 100 rows on its own, to find out if there are more pages
+        results, has_next = self._search_award_type_page(1, award_type = award_type)
+        pages = [results]
+
+        # the API doesn't tell us how many pages there are, so ask for the next few pages at the same time, and stop at the first page that says it's the last one
+        page = 2
+        with ThreadPoolExecutor(max_workers = self.search_page_window) as executor:
+            while has_next:
+                window = range(page, page + self.search_page_window)
+                for results, has_next in executor.map(self._search_award_type_page, window, [award_type] * len(window)):
+                    pages.append(results)
+                    if not has_next:
+                        # any pages we asked for after this one are past the end of the table. skip them
+                        break
+                page += self.search_page_window
+
+        # add the rows from every page to our dict, in page order
         out = {}
-        page = 1
-        has_next = True
-        while has_next:
-            # get up to 100 rows from the API
-            results, has_next = self._search_award_type_page(page, award_type = award_type)
-
-            # add those rows to our running list
+        for results in pages:
             for row in results:
                 # store awards by their long ID, not their short ID (ASST_NON_7200... instead of 7200...). we'll need that long ID for downloading the data folder
                 award_id = row["generated_internal_id"]
                 out[award_id] = row
-
-            page += 1
-            if has_next:
-                # wait 1 second before querying the API again, so we don't get locked out for making too many requests in a row
-                time.sleep(1)
         return out
     
     def search_awards(self):
@@ -298,14 +440,14 @@ class AwardSearchDownload:
             # get the awards for each award type
             awards = self._search_award_type(award_type)
 
-            # add the new awards to the dictionary
-            out = {**out, **awards}
+            # add the new awards to the dictionary in place, instead of copying everything we have so far into a new dictionary
+            out.update(awards)
 
         print(f"Found {len(out)} awards.")
 
-        # export all awards to a json
+        # export all awards to a json. json.dumps without indent uses the C encoder (json.dump and indent both fall back to pure python), and this file is only read back by code, so keep it compact
         with open(file_name, "w") as f:
-            json.dump(out, f, indent = 4, sort_keys=True)
+            f.write(json.dumps(out, sort_keys=True))
         self.export_downloaded_time(file_name)
 
     # -- Downloading awards
@@ -314,6 +456,39 @@ class AwardSearchDownload:
         """The file that stores info about where to check the status of the pending download."""
         return self.pending_downloads_folder() / f"{generated_award_id}.json"
     
+    def url_index_file(self) -> Path:
+        """The file that remembers where USASpending put the finished zip file for each award."""
+        return self.downloads_folder() / "_url_index.json"
+
+    def _load_url_index(self) -> dict[str, dict]:
+        """Import the url index as a dictionary keyed by award id."""
+        index_file = self.url_index_file()
+        if not index_file.exists():
+            return {}
+        with open(index_file) as f:
+            return json.load(f)
+
+    def save_file_url(self, generated_award_id: str, file_url: str) -> None:
+        """Remember where the finished zip file for this award is, so we can download it again without asking the API to prepare it again."""
+        with self._url_index_lock:
+            url_index = self._load_url_index()
+            url_index[generated_award_id] = {"file_url": file_url, "fetched_at": datetime.now().isoformat()}
+            # this file grows with every award and gets rewritten after every download, so write it compactly with the C encoder like the awards json
+            with atomic_file(self.url_index_file()) as temp_file, open(temp_file, "w") as f:
+                f.write(json.dumps(url_index))
+
+    def saved_file_url(self, generated_award_id: str) -> tuple[str, datetime] | None:
+        """Get the file url that the API gave us for this award and when it gave it to us, or None if we don't have one or it is older than the critical download date."""
+        with self._url_index_lock:
+            entry = self._load_url_index().get(generated_award_id)
+        if entry is None:
+            return None
+        fetched_at = datetime.fromisoformat(entry["fetched_at"])
+        if self.critical_download_date is not None and fetched_at < self.critical_download_date:
+            # the zip file was prepared before the critical download date. ask for a new one
+            return None
+        return entry["file_url"], fetched_at
+
     def downloaded_award_folder(self, generated_award_id: str) -> Path:
         """The folder to export the downloaded data."""
         return self.downloads_folder() / generated_award_id
@@ -336,7 +511,7 @@ class AwardSearchDownload:
         kwargs = { "award_id": generated_award_id }
 
         # make the request
-        response = requests.post(url, json = kwargs)
+        response = self.session.post(url, json = kwargs)
 
         # get the result from the request. if the request succeeded and USASpending is preparing the file, the response will have a status_url and a file_url in it. The status_url tells us where to look for the status of the download being prepared. file_url is where the file will be when it's ready to download.
         res = response.json()
@@ -364,8 +539,12 @@ class AwardSearchDownload:
         if not filename.exists():
             # no download time. assume one from the federalaccountfunding
             for file in self.downloaded_award_folder(generated_award_id).rglob("*FederalAccountFunding_1.csv"):
-                # import the csv as a pandas dataframe
-                df = pd.read_csv(file)
+                # import the only column we need, from the parquet copy if we saved one
+                parquet_file = file.with_suffix(".parquet")
+                if parquet_file.exists():
+                    df = pd.read_parquet(parquet_file, columns = ["award_latest_action_date"])
+                else:
+                    df = pd.read_csv(file, usecols = ["award_latest_action_date"])
 
                 # get the last date in the award_latest_action_date column
                 last_funded: datetime = pd.to_datetime(df["award_latest_action_date"]).max()
@@ -380,35 +559,63 @@ class AwardSearchDownload:
         with open(filename) as f:
             return datetime.fromisoformat(f.read())
 
-    def _download_files(self, file_url: str, generated_award_id: str) -> None:
+    def _download_files(self, file_url: str, generated_award_id: str, fetched_at: datetime | None = None) -> None:
         """Download the zip file from the file url, and save it to the award's download folder.
         
         Args:
             file_url: the url where usaspending is going to put the data to download
             generated_award_id: the long name of the award
+            fetched_at: when the API prepared the zip file, if we saved the url earlier. the data is only as new as this, so this is what we note down as the download time. leave it out for a zip file that was just prepared
 
         Output: downloads and unzips the folder to the data/downloads folder
         """
         # determine where to save the downloaded files
         award_folder = self.downloaded_award_folder(generated_award_id)
 
-        # download the zip file
-        res3 = requests.get(file_url)
+        # download the zip file. stream it to a temporary file as it arrives. small zip files stay in memory, and big ones move to disk once they pass zip_memory_limit
+        with self.session.get(file_url, stream = True) as res3, tempfile.SpooledTemporaryFile(max_size = self.zip_memory_limit) as zip_file:
+            # raise an error if the file isn't there (e.g. the link expired)
+            res3.raise_for_status()
+            for block in res3.iter_content(chunk_size = 1024 * 1024):
+                zip_file.write(block)
 
-        # read the zip file
-        z = zipfile.ZipFile(io.BytesIO(res3.content))
+            # extract all the files in the zip folder to the award folder
+            zip_file.seek(0)
+            award_folder.mkdir(parents = True, exist_ok = True)
+            with zipfile.ZipFile(zip_file) as z:
+                z.extractall(award_folder)
 
-        # extract all the files in the zip folder to the award folder
-        z.extractall(award_folder)
+        # save a parquet copy of each table, so combining awards doesn't have to parse the csvs again
+        for tag in self.valid_file_tags:
+            for csv_file in award_folder.rglob(f"*{tag}_1.csv"):
+                self._save_parquet_copy(csv_file, tag)
 
         # drop a file into the award folder noting down when we downloaded it
+        if fetched_at is None:
+            fetched_at = datetime.now()
         with open(self.downloaded_file(generated_award_id), "w") as f:
-            now = datetime.now()
-            f.write(now.isoformat())
+            f.write(fetched_at.isoformat())
 
         # print status update
         print(f"Data extracted to {award_folder}")
 
+    def _save_parquet_copy(self, csv_file: Path, tag: str) -> None:
+        """Save a parquet copy of a downloaded csv next to it. The csv stays where it is, so if this fails, combining the awards just reads the csv."""
+        try:
+            df = pd.read_csv(csv_file, dtype = self.tag_dtypes[tag])
+            with atomic_file(csv_file.with_suffix(".parquet")) as temp_file:
+                self._export_parquet(df, temp_file)
+        except (ValueError, TypeError, pyarrow.lib.ArrowException) as e:
+            # not every arrow error is also a ValueError or TypeError (e.g. ArrowNotImplementedError for a column type parquet can't store), and none of them should stop the download
+            print(f"Couldn't save a parquet copy of {csv_file.name}: {e}")
+
+    def _parquet_copy(self, csv_file: Path) -> Path | None:
+        """Get the parquet copy of a downloaded csv, or None if we don't have one that's up to date (e.g. the award was downloaded before we saved copies, or the copy is older than the csv)."""
+        parquet_file = csv_file.with_suffix(".parquet")
+        if not parquet_file.exists() or parquet_file.stat().st_mtime < csv_file.stat().st_mtime:
+            return None
+        return parquet_file
+
     def check_download_status(self, generated_award_id: str) -> bool:
         """Check if the download that we previously requested is ready, and download it if it is ready.
         
@@ -424,13 +631,14 @@ class AwardSearchDownload:
 
         if "status_url" in request_dict and "file_url" in request_dict:
             # check the status url
-            status_dict: dict = requests.get(request_dict["status_url"]).json()
+            status_dict: dict = self.session.get(request_dict["status_url"]).json()
             status = status_dict.get("status", "unknown")
             if status == "ready":
                 print(f"{generated_award_id}    Queued")
             else:
                 print(f"{generated_award_id}    {status}, {status_dict.get('seconds_elapsed', 'unknown')} seconds elapsed")
             if status == "finished":
+                self.save_file_url(generated_award_id, request_dict["file_url"])
                 self._download_files(request_dict["file_url"], generated_award_id)
                 pending_file.unlink()  # delete the pending file so we know we already downloaded this data
                 return False
@@ -468,6 +676,16 @@ class AwardSearchDownload:
             else:
                 # no critical download date, don't overwrite
                 return False
+
+        # check if the API already prepared a zip file for this award (e.g. the download folder got deleted), and download it directly
+        saved = None if overwrite else self.saved_file_url(generated_award_id)
+        if saved is not None:
+            file_url, fetched_at = saved
+            try:
+                self._download_files(file_url, generated_award_id, fetched_at)
+                return False
+            except (requests.HTTPError, zipfile.BadZipFile):
+                print(f"The saved download link for {generated_award_id} doesn't work anymore. Requesting a new download.")
         
         # check if we've already requested this data
         request_succeeded = self.request_download(generated_award_id)
@@ -478,49 +696,67 @@ class AwardSearchDownload:
         time.sleep(5)
         
         attempt = 0
+        delay = self.poll_delay
         while attempt < tries:
             pending = self.check_download_status(generated_award_id)
             if pending:
-                # there is still a download pending. wait and ask again
+                # there is still a download pending. wait and ask again. big downloads can take minutes, so wait longer each time instead of asking every few seconds
                 attempt += 1
-                time.sleep(5)
+                # add up to a second of jitter, so the awards in a chunk don't all check their status at the same moment
+                time.sleep(delay + random.uniform(0, 1))
+                delay = min(delay * 1.5, self.max_poll_delay)
             else:
                 return pending
         return pending
 
     def download_awards_chunk(self, awards: list[str], orig_num_rows: int, stop_on_errors: bool, starting_num: int) -> None:
-        # iterate through awards and try to download all the awards
-        new_pending_list = awards.copy()
-        while len(new_pending_list) > 0:
-            i = 0
-            # reset the list of pending awards
-            pending_list = new_pending_list
-            new_pending_list = []
-            for award_id in pending_list:
-                try:
+        # iterate through awards and try to download all the awards. almost all of the time is spent waiting on the API, so we request and watch up to award_download_workers awards at the same time
+        if len(awards) == 0:
+            return
+        new_pending_list = awards
+        # no with block here: leaving a with block waits for every running download, even when we're aborting
+        executor = ThreadPoolExecutor(max_workers = min(len(awards), self.award_download_workers))
+        try:
+            while len(new_pending_list) > 0:
+                # reset the list of pending awards
+                pending_list = new_pending_list
+                new_pending_list = []
+                futures = {}
+                for i, award_id in enumerate(pending_list):
                     print(f"{starting_num + i + 1} / {orig_num_rows} {award_id}")
-                    award_pending = self.download_award_data(award_id)
-                    if award_pending:
-                        # if the award still has a download pending, put it back in the list of pending awards
-                        new_pending_list.append(award_id)
-                except KeyboardInterrupt:
-                    raise KeyboardInterrupt
-                except Exception as e:
-                    if "Connection aborted" in str(e):
-                        print("The server aborted the connection because we've made too many requests. Waiting 5 minutes...")
-                        new_pending_list.append(award_id)
-                        time.sleep(60*5)
-                    elif "Max retries exceeded with url" in str(e):
-                        print("Connection problem. Waiting 5 minutes...")
-                        new_pending_list.append(award_id)
-                        time.sleep(60*5)
-                    else:
-                        print(e)
-                        if stop_on_errors:
-                            raise e
+                    futures[executor.submit(self.download_award_data, award_id)] = award_id
+
+                wait_for_server = False
+                for future in as_completed(futures):
+                    award_id = futures[future]
+                    try:
+                        award_pending = future.result()
+                        if award_pending:
+                            # if the award still has a download pending, put it back in the list of pending awards
+                            new_pending_list.append(award_id)
+                    except Exception as e:
+                        if "Connection aborted" in str(e):
+                            print("The server aborted the connection because we've made too many requests.")
+                            new_pending_list.append(award_id)
+                            wait_for_server = True
+                        elif "Max retries exceeded with url" in str(e):
+                            print("Connection problem.")
+                            new_pending_list.append(award_id)
+                            wait_for_server = True
                         else:
-                            pass
-                i += 1
+                            print(e)
+                            if stop_on_errors:
+                                raise e
+
+                if wait_for_server:
+                    # the other awards in the chunk were probably cut off too, so wait once for the whole chunk instead of once per award
+                    print("Waiting 5 minutes...")
+                    time.sleep(60*5)
+        except BaseException:
+            # we're aborting (keyboard interrupt or stop_on_errors). don't start any awards that are still waiting for a thread, and return right away instead of waiting for the ones in progress. those finish in the background, and python still waits for them before it exits
+            executor.shutdown(wait = False, cancel_futures = True)
+            raise
+        executor.shutdown()
 
     def download_awards(self, stop_on_errors: bool = True) -> None:
         """Download the award data zip for all of the awards in the awards json, and extract it to a data folder.
@@ -532,64 +768,54 @@ class AwardSearchDownload:
 
         Output: saves a bunch of files to the data folder
         """
-        new_pending_list = self.generated_award_ids() 
-        orig_num_rows = len(new_pending_list)
+        award_ids = self.generated_award_ids()
+        orig_num_rows = len(award_ids)
 
-        
         chunk_size = 10
-        j0 = 0
-        jf = j0 + chunk_size
-
-        while j0 <= len(new_pending_list):
+        for j0 in range(0, orig_num_rows, chunk_size):
+            jf = min(orig_num_rows, j0 + chunk_size)
             print(f"Downloading award {j0} to {jf}")
             self.download_awards_chunk(
-                awards = new_pending_list[j0:min(len(new_pending_list),jf)],
+                awards = award_ids[j0:jf],
                 orig_num_rows = orig_num_rows,
                 stop_on_errors = stop_on_errors,
                 starting_num = j0
             )
-            j0 = j0 + chunk_size
-            jf = jf + chunk_size
 
     def generated_award_ids(self) -> list[str]:
         """A list of all of the long award IDs that we're looking for, saved in our award json."""
         file = self.award_json()
         if not file.exists():
             return []
-        with open(self.award_json()) as f:
-            award_dict: dict = json.load(f)
-        return list(award_dict.keys())
+        # the award json can be large, and we need the ids for every stage. only read it again if it changed since the last time
+        stat = file.stat()
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        if self._award_ids_cache is None or self._award_ids_cache[0] != stamp:
+            with open(file) as f:
+                award_dict: dict = json.load(f)
+            self._award_ids_cache = (stamp, list(award_dict.keys()))
+        # hand back a copy, so callers can't change the cached list
+        return list(self._award_ids_cache[1])
 
     # -- Combining awards
 
-    def _calculate_outlays_for_indices(self, df: pd.DataFrame, class_indices: pd.Series) -> None:
-        """For a given list of indices, calculate the per-period outlays from the gross outlays.
-        
-        Args:
-            df: the dataframe for all years and categories
-            class_indices: a true/false list that indicates which rows are grouped together
-
-        Output: updates the dataframe in the specified rows
-        
-        """
-        gross_outlays = df.loc[class_indices, "gross_outlay_amount_FYB_to_period_end"]   
-            # get the cumulative outlays
-        df.loc[class_indices, "transaction_outlay_amount"] = gross_outlays.diff().fillna(gross_outlays)   
-            # calculate as this row - prev row, or this row if there is no previous row
-
     def _check_class_codes(self, df: pd.DataFrame, indices: pd.Series, fy: int) -> list[float]:
         class_codes = df.loc[indices, "object_class_code"].unique()
         if 0 in class_codes and len(class_codes) > 1:
             # there are unknown classes. determine if they should be combined with the next class or not
-            if len(df.loc[indices & (df["submission_period"]==f"FY{fy}P12") & (df["object_class_code"]==0)]) == 0:
+            # pull out this year's rows once, instead of masking the whole dataframe for every period
+            year_rows = df.loc[indices, ["submission_period", "object_class_code", "gross_outlay_amount_FYB_to_period_end"]]
+            unknowns = year_rows["object_class_code"] == 0
+            if not (unknowns & (year_rows["submission_period"] == f"FY{fy}P12")).any():
                 # there is no 12th period marked, which means this unknown category was combined with other categories in the last period. combine all categories as the same time series
                 class_codes = [code for code in class_codes if code > 0]
                 replacement_code = class_codes[0]
-                for period in range(1, 13):
-                    period_indices = (df["submission_period"]==f"FY{fy}P{period}")
-                    unknown_gross = df.loc[indices & period_indices & (df["object_class_code"]==0), "gross_outlay_amount_FYB_to_period_end"].sum()
-                    catchers = indices & period_indices & (df["object_class_code"]==replacement_code)
-                    df.loc[catchers, "gross_outlay_amount_FYB_to_period_end"] += unknown_gross
+                # total the unknown gross outlays for each period, and add each total to the replacement category's rows in that period
+                periods = [f"FY{fy}P{period}" for period in range(1, 13)]
+                unknown_rows = year_rows[unknowns & year_rows["submission_period"].isin(periods)]
+                unknown_gross = unknown_rows.groupby("submission_period")["gross_outlay_amount_FYB_to_period_end"].sum()
+                catchers = indices & (df["object_class_code"]==replacement_code)
+                df.loc[catchers, "gross_outlay_amount_FYB_to_period_end"] += df.loc[catchers, "submission_period"].map(unknown_gross).fillna(0)
                 return class_codes
             else:
                 # the unknowns have their own 12th period. treat them as their own thing
@@ -598,120 +824,230 @@ class AwardSearchDownload:
             # no unknowns. proceed as normal.
             return class_codes
 
-    def _calculate_outlays_for_fiscal_year(self, df: pd.DataFrame, fy: int, outlays: pd.Series) -> None:
-        """For a given fiscal year, break up the rows by category and calculate the per-period outlays from the gross outlays.
-        
+    def _calculate_outlays(self, df: pd.DataFrame, outlays: pd.Series) -> None:
+        """Calculate the per-period outlays from the gross outlays, which add up over each fiscal year and category.
+
         Args:
-            df: the dataframe for all years, categories in the TAS code
-            fy: fiscal year
+            df: the dataframe for all years, categories in the TAS code, sorted by submission period
             outlays: a True/False list that indicates which rows we're looking at
 
         Output: nothing. we're passing around a pointer to a dataframe, so the changes will be applied without us returning it
         """
-        indices = (df["fiscal_year"] == fy)&outlays
-        if len(df[indices]) == 0:
-            return
-        class_codes = self._check_class_codes(df, indices, fy)
-                
-        for class_code in class_codes:
-            class_indices = indices & (df["object_class_code"] == class_code)
-            self._calculate_outlays_for_indices(df, class_indices)
+        # find which categories get their own time series in each fiscal year. this also folds any unknown categories into the gross outlays of another category
+        grouped = pd.Series(False, index = df.index)
+        for fy in df.loc[outlays, "fiscal_year"].unique():
+            indices = (df["fiscal_year"] == fy)&outlays
+            class_codes = self._check_class_codes(df, indices, fy)
+            grouped |= indices & df["object_class_code"].isin(class_codes)
+
+        # diff every fiscal year and category at once. each row is this row - prev row in its group, or this row if there is no previous row
+        gross_outlays = df.loc[grouped, "gross_outlay_amount_FYB_to_period_end"]
+        groups = [df.loc[grouped, "fiscal_year"], df.loc[grouped, "object_class_code"]]
+        df.loc[grouped, "transaction_outlay_amount"] = gross_outlays.groupby(groups, sort = False).diff().fillna(gross_outlays)
+
+    def _tas_rows(self, df: pd.DataFrame, column: str, exact: bool) -> pd.DataFrame:
+        """Filter a table from an award download to only the rows for this TAS code.
+
+        Args:
+            df: the table to filter
+            column: the column that holds the TAS code for each row
+            exact: true if the column holds a single TAS code, false if it holds a list of TAS codes
+        """
+        if exact:
+            keep = df[column] == self.tas_code
+        else:
+            # the TAS code is plain text, not a pattern, so skip the regex engine. rows with no TAS codes don't match
+            keep = df[column].str.contains(self.tas_code, regex = False, na = False)
+        return df[keep]
+
+    def _read_filtered_rows(self, file: Path, tag: str, column: str, exact: bool) -> pd.DataFrame:
+        """Read a csv from an award download, and only keep the rows for this TAS code. Read its parquet copy instead if we can, because it's much faster than parsing the csv, and the same downloads get combined for many TAS codes. Otherwise, read the csv.
+
+        Args:
+            file: the csv to read
+            tag: FederalAccountFunding, TransactionHistory, or Sub-Awards. tells us which column types we know ahead of time
+            column: the column that holds the TAS code for each row
+            exact: true if the column holds a single TAS code, false if it holds a list of TAS codes
+
+        Output: a dataframe with only the rows for this TAS code
+        """
+        parquet_file = self._parquet_copy(file)
+        if parquet_file is not None:
+            # let pyarrow skip the rows for other TAS codes while it reads the file, instead of loading everything and filtering in pandas. rows with no TAS codes don't match
+            if exact:
+                keep = pc.field(column) == self.tas_code
+            else:
+                # the TAS code is plain text, not a pattern
+                keep = pc.match_substring(pc.field(column), self.tas_code)
+            return pd.read_parquet(parquet_file, filters = keep)
+
+        # parse the whole csv, so every column gets the same types as it does in the parquet copy, then filter
+        return self._tas_rows(pd.read_csv(file, dtype = self.tag_dtypes[tag]), column, exact)
 
     def _import_award_federal_account_funding(self, file: Path) -> pd.DataFrame:
         """Given a FederalAccountFunding.csv file, import the table, add useful columns, and return a dataframe."""
-        df = pd.read_csv(file)
+        # in the FederalAccountFunding file, the tas code is stored under the treasury_account_symbol column
+        df = self._read_filtered_rows(file, "FederalAccountFunding", "treasury_account_symbol", exact = True)
         if len(df) == 0:
             return df
         pac = program_activity_codes()
-        # in the FederalAccountFunding file, the tas code is stored under the treasury_account_symbol column
-        df = df[df["treasury_account_symbol"] == self.tas_code]
+        # sort once by period. the outlay groupby below keeps this order within each fiscal year and category, so nothing else needs to sort
         df.sort_values(by="submission_period", inplace=True)
         # add columns for fiscal year (2024), fiscal period (P3), program activity code (1,2,3,4), program activity title (Grants and fixed charges...)
-        df["fiscal_year"] = [per[2:6] for per in df["submission_period"]]
-        df["fiscal_period"] = [per[6:] for per in df["submission_period"]]
-        df["pa_code"] = [int(s//10) for s in df["object_class_code"]]
-        df["pa_title"] = [pac[s] for s in df["pa_code"]]
-        
-        df.sort_values(by = "submission_period", inplace = True)
+        # submission periods look like FY2024P03. slice the whole column at once instead of looping over it in python
+        df["fiscal_year"] = df["submission_period"].str.slice(2, 6).astype("int64")
+        df["fiscal_period"] = df["submission_period"].str.slice(6)
+        df["pa_code"] = (df["object_class_code"] // 10).astype("int64")
+        df["pa_title"] = df["pa_code"].map(pac)
+
         # calculate outlay amounts. gross_outlay is cumulative per fiscal year and category
         outlays = (~pd.isna(df["gross_outlay_amount_FYB_to_period_end"]))&(df["gross_outlay_amount_FYB_to_period_end"]!=0)
-        for fy in df.loc[outlays, "fiscal_year"].unique():
-            self._calculate_outlays_for_fiscal_year(df, fy, outlays)
+        if outlays.any():
+            self._calculate_outlays(df, outlays)
         return df
 
     def _import_award_transaction_history(self, file: Path) -> pd.DataFrame:
         """In the TransactionHistory file, all relevant tas codes are combined into the column treasury_accounts_funding_this_award"""
-        df = pd.read_csv(file)
-        if len(df) == 0:
-            return df
-        tas_list = df["treasury_accounts_funding_this_award"].fillna("")
-        filtered = df[tas_list.str.contains(self.tas_code)]
-        return filtered
+        return self._read_filtered_rows(file, "TransactionHistory", "treasury_accounts_funding_this_award", exact = False)
     
     def _import_award_subawards(self, file: Path) -> pd.DataFrame:
         # in the TransactionHistory file, all relevant tas codes are combined into the column prime_award_treasury_accounts_funding_this_award
-        df = pd.read_csv(file)
-        if len(df) == 0:
-            return df
-        tas_list = df["prime_award_treasury_accounts_funding_this_award"].fillna("")
-        filtered = df[tas_list.str.contains(self.tas_code)]
-        return filtered
+        return self._read_filtered_rows(file, "Sub-Awards", "prime_award_treasury_accounts_funding_this_award", exact = False)
+
+    def _drop_duplicate_rows(self, df: pd.DataFrame, tag: str) -> pd.DataFrame:
+        """Remove duplicate rows from a combined table, the same way drop_duplicates does, keeping the first copy of each row.
+
+        Comparing every column of every row is slow for big tables, so first find the rows that share their key columns with another row. Rows with a unique key can't be duplicates, so we only compare whole rows for the rest.
+        """
+        key_columns = [column for column in self.tag_key_columns[tag] if column in df.columns]
+        if len(key_columns) == 0:
+            return df.drop_duplicates()
+        shared_key = df.duplicated(key_columns, keep = False)
+        repeated = df[shared_key].duplicated()
+        return df.drop(repeated.index[repeated])
 
-    def combine_tag_awards(self, tag: str, overwrite: bool = False):
-        """Combine all files for a specific tag into one file."""
+    def _award_files(self, awards: list[str]) -> dict[str, list[Path]]:
+        """Find the csvs for every tag in the download folders for these awards, walking each folder only once.
+
+        Args:
+            awards: the long award IDs to look for
+
+        Output: a dictionary where the keys are tags, and the values are lists of csvs, in the same order that rglob finds them
+        """
+        files = {tag: [] for tag in self.valid_file_tags}
         downloads_folder = self.downloads_folder()
+        for generated_award_id in awards:
+            for folder, _, file_names in os.walk(downloads_folder / generated_award_id):
+                for file_name in file_names:
+                    for tag in self.valid_file_tags:
+                        if file_name.endswith(f"{tag}_1.csv"):
+                            files[tag].append(Path(folder) / file_name)
+        return files
+
+    def combine_tag_awards(self, tag: str, overwrite: bool = False, award_files: dict[str, list[Path]] | None = None):
+        """Combine all files for a specific tag into one file.
+
+        Args:
+            tag: FederalAccountFunding, TransactionHistory, or Sub-Awards
+            overwrite: true to combine the files even if we already combined them after the critical download date
+            award_files: the csvs in each award's download folder, from _award_files. if this is None, we'll look for them
+        """
         # get the file name to export to
 
         file_name = self.combined_csv(tag)
+        forced = overwrite
         if not overwrite:
             overwrite = self.check_overwrite(file_name)
             if not overwrite:
                 return
         print(f"Combining files for {tag}")
 
-        # find all csvs in the award folder with the given tag
-        df_list = []
         awards = self.generated_award_ids()
         if len(awards) == 0:
             # no awards found. don't export this summary yet.
             return
 
-        # look specifically for the requested awards
-        for generated_award_id in awards:
-            award_folder = downloads_folder / generated_award_id
-            for file in award_folder.rglob(f"*{tag}_1.csv"):
-                # import the csv as a pandas dataframe and filter it to only rows with this tas
-                if tag == "FederalAccountFunding":
-                    df = self._import_award_federal_account_funding(file)
-                elif tag == "TransactionHistory":
-                    df = self._import_award_transaction_history(file)
-                elif tag == "Sub-Awards":
-                    df = self._import_award_subawards(file)
-                # add the pandas dataframe to the list of dataframes
-                if len(df) > 0:
-                    df_list.append(df)
+        # find all csvs with the given tag, looking specifically in the folders for the requested awards
+        if award_files is None:
+            award_files = self._award_files(awards)
+        files = award_files[tag]
+
+        # if none of the csvs changed since we last combined them, combining them again would give us the same file. unless we were told to redo it, keep the file we have
+        manifest = self._combine_manifest(files)
+        if not forced and file_name.exists() and manifest == self._saved_combine_manifest(tag):
+            print(f"No {tag} files changed since we last combined them. Keeping {file_name.name}")
+            self.export_downloaded_time(file_name)
+            return
+
+        # pick the function that imports the csv as a pandas dataframe and filters it to only rows with this tas
+        if tag == "FederalAccountFunding":
+            importer = self._import_award_federal_account_funding
+        elif tag == "TransactionHistory":
+            importer = self._import_award_transaction_history
+        elif tag == "Sub-Awards":
+            importer = self._import_award_subawards
+
+        # the files don't depend on each other, so import several at once. pandas lets go of the GIL while it parses, so threads work here. map keeps the results in the same order as the files
+        with ThreadPoolExecutor() as executor:
+            df_list = [df for df in executor.map(importer, files) if len(df) > 0]
 
         if len(df_list) > 0:
-            # combine all dataframes into one big dataframe
-            combined: pd.DataFrame = pd.concat(df_list)
+            # combine all dataframes into one big dataframe. we don't export the index, so don't spend time stitching the old ones together
+            combined: pd.DataFrame = pd.concat(df_list, ignore_index = True)
 
             # remove duplicate rows
-            combined.drop_duplicates(inplace=True)
+            combined = self._drop_duplicate_rows(combined, tag)
 
             # export to csv
             combined.to_csv(file_name, index = False)
 
+            # export a parquet copy for reading the table back in later
+            self._export_parquet(combined, self.combined_parquet(tag))
+
+            # write down which csvs went into this file
+            with open(self.combine_manifest_file(tag), "w") as f:
+                json.dump(manifest, f, indent = 4)
+
             self.export_downloaded_time(file_name)
 
+    def combine_manifest_file(self, tag: str) -> Path:
+        """File where we save which csvs went into the combined csv for this tag, and when they last changed."""
+        return self.combined_csv(tag).with_suffix(".manifest.json")
+
+    def _combine_manifest(self, files: list[Path]) -> dict:
+        """Describe a list of csvs by their path, modification time, and size, along with the TAS code we filter them for. If this doesn't change, combining them gives the same result."""
+        csvs = {}
+        for file in files:
+            stat = file.stat()
+            csvs[str(file)] = [stat.st_mtime_ns, stat.st_size]
+        return {"tas_code": self.tas_code, "files": csvs}
+
+    def _saved_combine_manifest(self, tag: str) -> dict | None:
+        """Import the manifest from the last time we combined this tag, or None if we don't have one."""
+        manifest_file = self.combine_manifest_file(tag)
+        if not manifest_file.exists():
+            return None
+        with open(manifest_file) as f:
+            return json.load(f)
+
+    def _export_parquet(self, df: pd.DataFrame, file_name: Path) -> None:
+        """Export a dataframe to parquet. Parquet needs one type per column, and the award downloads don't always agree (e.g. zip codes are sometimes numbers and sometimes text), so columns with mixed types are saved as text."""
+        mixed = [col for col in df.columns if df[col].dtype == object]
+        df.astype({col: "string" for col in mixed}).to_parquet(file_name, index = False)
+
     def combine_awards(self):
         """For each tag, combine all of the data from the data folders we downloaded, filter down to just the TAS codes we care about, and export the combined data to a csv."""
         downloads_folder = self.downloads_folder()
         if not downloads_folder.exists():
             raise FileNotFoundError("No downloaded files found.")
 
-        # iterate through FederalAccountFunding, TransactionHistory, and Sub-Awards
-        for tag in self.valid_file_tags:
-            self.combine_tag_awards(tag)
+        # look through the award folders once for all of the tags, instead of once per tag
+        award_files = self._award_files(self.generated_award_ids())
+
+        # iterate through FederalAccountFunding, TransactionHistory, and Sub-Awards. write down when we made each file all at once at the end
+        with self._batched_time_writes():
+            for tag in self.valid_file_tags:
+                self.combine_tag_awards(tag, award_files = award_files)
  
     # -- Checking sums
 
@@ -719,19 +1055,24 @@ class AwardSearchDownload:
         """Import the program activity summary as a dictionary."""
         paf = self.program_activity_file()
         if paf.exists():
-            with open(paf) as f:
-                return json.load(f)
+            return _load_json(str(paf), paf.stat().st_mtime_ns)
         else:
             return {}
 
-    def import_federal_account_funding_df(self) -> pd.DataFrame | None:
-        """Import the FederalAccountFunding csv as a pandas dataframe."""
+    def import_federal_account_funding_df(self, columns: list[str] | None = None) -> pd.DataFrame | None:
+        """Import the FederalAccountFunding table as a pandas dataframe, from the parquet copy if we have one that's up to date.
+
+        Args:
+            columns: only read these columns. leave this as None to read the whole table
+        """
         faf_file = self.combined_csv("FederalAccountFunding")
-        if faf_file.exists():
-            df = pd.read_csv(faf_file)
-            return df
-        else:
+        if not faf_file.exists():
             return None
+        # the csv is the real table. if it was rewritten after the parquet copy (e.g. the parquet export failed, or someone edited the csv), the copy is out of date, so read the csv instead
+        parquet_file = self._parquet_copy(faf_file)
+        if parquet_file is not None:
+            return pd.read_parquet(parquet_file, columns = columns)
+        return pd.read_csv(faf_file, usecols = columns)
 
     def _make_tabbed_line(self, title: str, pa: float, faf: float):
         diff = pa - faf
@@ -741,26 +1082,50 @@ class AwardSearchDownload:
             diff_pct = "--"
         return "".join([f"    {title}:".ljust(18), " PA:", f" ${pa:,}".rjust(15)," / FA: ", f"${faf:,}".rjust(15), " / Missing:", f" ${(diff):,}".rjust(15), f" ({diff_pct}%)" ])
 
-    def _compare_pa_to_faf(self, activity: dict, funding: pd.DataFrame, title: str) -> list[str]:
-        """Compare a program activity year to a FederalAccountFunding year, and return a list of strings to print out or write to file."""
+    def _compare_pa_to_faf(self, activity: dict, funding: tuple[int, float, float], title: str) -> list[str]:
+        """Compare a program activity year to a FederalAccountFunding year, and return a list of strings to print out or write to file.
+
+        Args:
+            activity: the program activity summary for the year or category
+            funding: the number of FederalAccountFunding rows for the year or category, and the sums of their obligations and outlays. see _funding_sums
+            title: what to call this comparison in the summary check
+        """
         lines = []
-        if len(activity) == 0 and len(funding) == 0:
+        rows, obligated, gross_outlay = funding
+        if len(activity) == 0 and rows == 0:
             return lines
         pa_obligated = int(activity.get("obligated_amount", 0))
         pa_gross_outlay = int(activity.get("gross_outlay_amount", 0))
-        faf_obligated = int(funding["transaction_obligated_amount"].sum())
-        faf_gross_outlay = int(funding["transaction_outlay_amount"].sum())
+        faf_obligated = int(obligated)
+        faf_gross_outlay = int(gross_outlay)
         lines.append(f"  {title}")
         lines.append(self._make_tabbed_line("Obligated", pa_obligated, faf_obligated))
         lines.append(self._make_tabbed_line("Gross Outlay", pa_gross_outlay, faf_gross_outlay))
         return lines
 
-    def _find_child(self, activity: dict, child: str):
-        children = activity.get("children", [])
-        for chil in children:
-            if chil["name"] == child:
-                return chil
-        return {}
+    def _funding_sums(self, df: pd.DataFrame, keys: list[str]) -> dict:
+        """Group the FederalAccountFunding table, and sum the obligations and outlays for every group in one pass.
+
+        Args:
+            df: the FederalAccountFunding table
+            keys: the columns to group by, e.g. ["fiscal_year"] or ["fiscal_year", "pa_code"]
+
+        Output: a dictionary where the keys are the group (2024 or (2024, 4)), and the values are (number of rows, obligated sum, outlay sum)
+        """
+        grouped = df.groupby(keys)
+        sums = grouped[["transaction_obligated_amount", "transaction_outlay_amount"]].sum()
+        sizes = grouped.size()
+        return {
+            key: (rows, obligated, gross_outlay)
+            for key, rows, obligated, gross_outlay in zip(sizes.index, sizes, sums["transaction_obligated_amount"], sums["transaction_outlay_amount"])
+        }
+
+    def _children_by_name(self, activity: dict) -> dict[str, dict]:
+        """Index the children of a program activity year by name, so we can look each category up directly. If two children have the same name, keep the first one."""
+        children = {}
+        for chil in activity.get("children", []):
+            children.setdefault(chil["name"], chil)
+        return children
 
     def _export_summary_lines(self, lines: list[str]):
         """Export lines of text to the summary check file."""
@@ -782,19 +1147,28 @@ class AwardSearchDownload:
         lines = [f"TAS code: {self.tas_code}"]
         # import the program activity file and the federal account funding summary
         program_activity = self.import_program_activity()
-        df = self.import_federal_account_funding_df()
+        # the check only sums obligations and outlays by year and category, so skip the rest of the columns
+        df = self.import_federal_account_funding_df(columns = ["fiscal_year", "pa_code", "transaction_obligated_amount", "transaction_outlay_amount"])
 
         # don't export anything if we're missing FAF or program activity
         if len(program_activity) == 0 or df is None:
             return
 
-        # iterate through fiscal years and sum data
+        # the program activity codes are the same for every year, so build them once
+        pac = program_activity_codes()
+
+        # sum the FAF rows for every fiscal year, and every fiscal year and category, instead of filtering the table again for each one
+        no_funding = (0, 0.0, 0.0)
+        year_sums = self._funding_sums(df, ["fiscal_year"])
+        code_sums = self._funding_sums(df, ["fiscal_year", "pa_code"])
+
+        # iterate through fiscal years and compare the sums
         for fiscal_year in self.fiscal_year_range():
-            # get activity summary and FAF rows for this fiscal year
+            # get activity summary and FAF sums for this fiscal year
             activity_list: list[dict] = program_activity.get(str(fiscal_year))
-            funding = df[df["fiscal_year"] == fiscal_year]
+            funding = year_sums.get(fiscal_year, no_funding)
 
-            if len(activity_list) > 0 or len(funding) > 0:
+            if len(activity_list) > 0 or funding[0] > 0:
                 if len(activity_list) > 0:
                     activity = activity_list[0]
                 else:
@@ -805,11 +1179,12 @@ class AwardSearchDownload:
                 lines = lines + self._compare_pa_to_faf(activity=activity, funding = funding, title = "Total")
 
                 # compare the subgroups
-                for code, child in program_activity_codes().items():
-                    subdf = funding[funding["pa_code"]==code]
-                    subchil = self._find_child(activity, child)
-                    if len(subdf) > 0 or len(subchil) > 0:
-                        lines = lines + self._compare_pa_to_faf(subchil, subdf, title = f"{code}X: {child}")
+                children = self._children_by_name(activity)
+                for code, child in pac.items():
+                    subfunding = code_sums.get((fiscal_year, code), no_funding)
+                    subchil = children.get(child, {})
+                    if subfunding[0] > 0 or len(subchil) > 0:
+                        lines = lines + self._compare_pa_to_faf(subchil, subfunding, title = f"{code}X: {child}")
 
         # write the result to file
         self._export_summary_lines(lines)
@@ -1,3 +1,4 @@
+import re
 import pandas as pd
 
 from usa_types import DATA_FOLDER
@@ -5,6 +6,21 @@ from usa_types import DATA_FOLDER
 class SpendingCategories:
     """Class for categorizing awards."""
 
+    # the category columns in the KFF sheet, in the order we list them
+    health_categories = ("Health?", "FPRH", "HIV-AIDS", "Health - General", "Malaria", "MCH", "Nutrition", "Other Public Health Threats", "PIOET", "TB")
+    # words in a transaction description that mark each category
+    guess_keywords = {
+        "tuberculosis": "TB",
+        "malaria": "Malaria",
+        "hiv": "HIV-AIDS",
+        "nutrition": "Nutrition",
+        "health": "Health?",
+        "maternal": "MCH",
+        "reprod": "FPRH",
+    }
+    # the lookahead finds a keyword starting at every position, so keywords that overlap are all found like separate in checks would
+    guess_pattern = re.compile("(?=(" + "|".join(map(re.escape, guess_keywords)) + "))")
+
     def __init__(self, tas_code: str):
         self.tas_code = tas_code
     
@@ -16,47 +32,50 @@ class SpendingCategories:
     
     # -- Private methods
 
-    def _health_categories(self):
-        return ["Health?","FPRH","HIV-AIDS","Health - General","Malaria","MCH","Nutrition","Other Public Health Threats","PIOET","TB"]
+    def _health_categories(self) -> list[str]:
+        return list(self.health_categories)
 
     def _blank_categories(self) -> dict:
-        return {key: False for key in self._health_categories()}
+        return dict.fromkeys(self.health_categories, False)
 
     def _load_kff_categories(self) -> dict[str, dict]:
         file = self.kff_csv()
         df = pd.read_csv(file)
+        categories = self._health_categories()
+        # check which categories each award is marked with all at once. astype(bool) uses the same truthiness as checking each cell with if
+        flags = df[categories].astype(bool).to_numpy().tolist()
         out = {}
-        for _, row in df.iterrows():
-            newrow = row.to_dict()
-            newrow["categories"] = []
-            newrow["category"] = ""
-            for key in self._health_categories():
-                if row[key]:
-                    newrow["categories"].append(key)
-                    newrow["category"] = key
-            newrow["categories"] = ", ".join(newrow["categories"])
+        # to_dict builds all of the rows at once, which is much faster than building a Series for every row with iterrows
+        for newrow, row_flags in zip(df.to_dict(orient = "records"), flags):
+            matched = [key for key, flag in zip(categories, row_flags) if flag]
+            newrow["categories"] = ", ".join(matched)
+            # the last category that matched is the main category
+            newrow["category"] = matched[-1] if len(matched) > 0 else ""
             out[newrow["Award ID"]] = newrow
         return out
     
     def _guess_category(self, description: str, newrow: dict | None = None) -> dict:
-        """Guess the categories based on transaction descriptions."""
+        """Guess the categories based on a transaction description. This uses the same guess_keywords as _guess_categories, but scans a plain string, since building a Series for one description is much slower than the search itself. To guess for a lot of descriptions, call _guess_categories on the whole column instead."""
         if newrow is None:
             newrow = self._blank_categories()
         val = str(description).lower()
-        if "tuberculosis" in val:
-            newrow["TB"] = True
-        if "malaria" in val:
-            newrow["Malaria"] = True
-        if "hiv" in val:
-            newrow["HIV-AIDS"] = True
-        if "nutrition" in val:
-            newrow["Nutrition"] = True
-        if "health" in val:
-            newrow["Health?"] = True
-        if "maternal" in val:
-            newrow["MCH"] = True
-        if "reprod" in val:
-            newrow["FPRH"] = True
+        # one scan over the description instead of a separate scan for every keyword
+        for word in self.guess_pattern.findall(val):
+            newrow[self.guess_keywords[word]] = True
         return newrow
 
+    def _guess_categories(self, descriptions: pd.Series) -> pd.DataFrame:
+        """Guess the categories for a whole column of transaction descriptions at once. This gives the same answer as calling _guess_category on each description, but does each keyword search over the whole column.
+
+        Args:
+            descriptions: the transaction descriptions
+
+        Output: a dataframe with the same index as the descriptions, and a true/false column for each category
+        """
+        text = descriptions.astype(str).str.lower()
+        out = pd.DataFrame(self._blank_categories(), index = descriptions.index)
+        for word, category in self.guess_keywords.items():
+            out[category] = text.str.contains(word, regex = False)
+        return out
+
 
@@ -1,6 +1,9 @@
 import requests
 import json
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+from usa_types import api_session
 
 DATA_FOLDER = Path(__file__).parent.parent / "data" / "usaspending"
 
@@ -8,11 +11,20 @@ def lookup_foreign_budget():
     url = "https://foreignassistance.gov/data-api/complete-data.json"
     sectors = ["Other Public Health Threats", "Nutrition", "Tuberculosis", "Maternal and Child Health", "Family Planning and Reproductive Health", "HIV/AIDS", "Malaria", "Pandemic Influenza and Other Emerging Threats (PIOET)", "Water Supply and Sanitation"]
     
-    out = {}
-    for sector in sectors:
+    # one session keeps the connection to the api alive, with enough connections for every sector at once
+    session = api_session(pool_connections = 1, pool_maxsize = len(sectors))
+
+    def fetch_sector(sector: str) -> requests.Response:
         params = {"funding_account_id": "19x1031", "per_page": 1000, "usg_sector_name": sector}
+        return session.get(url, params = params)
+
+    # fetch all of the sectors at the same time, since each request is mostly waiting on the api
+    with ThreadPoolExecutor(max_workers = len(sectors)) as executor:
+        responses = list(executor.map(fetch_sector, sectors))
+
+    out = {}
+    for sector, res in zip(sectors, responses):
         new_out = {}
-        res = requests.get(url, params = params)
         for row in res.json()["data"]:
             fiscal_year = int(row["fiscal_year"])
             if fiscal_year not in new_out:
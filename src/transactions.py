@@ -1,20 +1,43 @@
 from pathlib import Path
+import json
+import hashlib
+from datetime import datetime
 import pandas as pd
-import time
-import requests
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 
-from usa_types import DATA_FOLDER, SPENDING_BY_TRANSACTION, usaid_tas
+from usa_types import DATA_FOLDER, SPENDING_BY_TRANSACTION, usaid_tas, api_session, RateLimiter, atomic_file, cache_is_fresh, clear_stale_files
+
+# the award types and columns we ask for in every transaction search. these never change, so build them once instead of every time we ask for a page
+_TRANSACTION_AWARD_TYPE_CODES = ("A", "B", "C", "D", "02", "03", "04", "05", "06", "07", "08", "09", "10", "11", "IDV_A", "IDV_B", "IDV_B_A", "IDV_B_B", "IDV_B_C", "IDV_C", "IDV_D", "IDV_E")
+_TRANSACTION_SEARCH_FIELDS = ("internal_id", "Action Date", "Action Type", "Assistance Listing", "Award ID", "Award Type", "Awarding Agency", "Awarding Sub Agency", "Funding Agency", "Funding Sub Agency", "Issued Date", "Last Date to Order", "Loan Value", "Mod", "NAICS", "PSC", "Primary Place of Performance", "Recipient Location", "Recipient Name", "Recipient UEI", "Subsidy Cost", "Transaction Amount", "Transaction Description")
 
 class USASpendingTransactions:
+    search_page_window = 5  # number of search pages to ask for at the same time
+    search_requests_per_second = 5  # most search requests to start per second, so we don't overload the API
+    search_cache_seconds = 60 * 60  # how long a saved page of transaction search results stays good
+    # id and code columns in the saved pages. the API sends these as text, so read them back as text instead of letting pandas guess numbers (which turns a cfda number like 10.100 into 10.1, and codes in columns with blanks into floats)
+    page_dtypes = {
+        "internal_id": "str",
+        "Award ID": "str",
+        "Mod": "str",
+        "Recipient UEI": "str",
+        "cfda_number": "str",
+        "NAICS code": "str",
+        "PSC code": "str",
+    }
     
-    def __init__(self, min_year: int, max_year: int):
+    def __init__(self, min_year: int, max_year: int, critical_download_date: datetime | None = None):
         self.min_year = min_year
         self.max_year = max_year
-        summary_folder = self.summary_folder()
-        download_folder = self.downloads_folder()
-        for folder in [summary_folder, download_folder]:
-            if not folder.exists():
-                folder.mkdir()
+        self.critical_download_date = critical_download_date  # results saved before this date are too old to reuse
+        # reuse the connection to the API for every page instead of opening a new one each time. the transaction search only reads data, so it's safe to retry its POSTs
+        self.session = api_session(retry_posts = True)
+        self._search_rate = RateLimiter(self.search_requests_per_second)  # search pages are requested on several threads, and they all share the same rate limit
+        for folder in [self.summary_folder(), self.downloads_folder(), self.search_cache_folder()]:
+            # exist_ok instead of checking first, so two searches starting at once can't both try to create the same folder
+            folder.mkdir(parents = True, exist_ok = True)
+        clear_stale_files(self.search_cache_folder(), self.search_cache_seconds)
 
     # -- File names
 
@@ -27,21 +50,31 @@ class USASpendingTransactions:
     def combined_csv(self) -> Path:
         return self.summary_folder() / f"combined_transactions_{self.min_year}_{self.max_year}.csv"
 
+    def search_cache_folder(self) -> Path:
+        """Folder that holds recent pages of transaction search results, so a search that fails partway through doesn't have to start over. The award search keeps its pages in its own folder next to this one."""
+        return DATA_FOLDER / "search_cache" / "transactions"
+
     # -- Scrapers
 
     def search_transactions(self):
         """Look up all of the transactions for the given time range and TAS."""
         out = {}
-        for year in range(self.min_year, self.max_year):
-            page = 1
-            has_next = True
-            while has_next:
-                print(year, "page",  page)
-                has_next, rows = self._year_page_transactions(year, page)
-                page += 1
-                for row in rows:
-                    out[row["internal_id"]] = row
-            time.sleep(1)
+        with ThreadPoolExecutor(max_workers = self.search_page_window) as executor:
+            for year in range(self.min_year, self.max_year):
+                # the API doesn't tell us how many pages there are, so ask for the next few pages at the same time, and stop at the first page that says it's the last one
+                page = 1
+                has_next = True
+                while has_next:
+                    window = range(page, page + self.search_page_window)
+                    for page_number, (has_next, rows) in zip(window, executor.map(self._year_page_transactions, [year] * len(window), window)):
+                        print(year, "page",  page_number)
+                        self._save_page(year, page_number, rows)
+                        for row in rows:
+                            out[row["internal_id"]] = row
+                        if not has_next:
+                            # any pages we asked for after this one are past the end of the results. skip them
+                            break
+                    page += self.search_page_window
         df = pd.DataFrame(out.values())
         df.sort_values(by = "Action Date", inplace = True)
         df.to_csv(self.combined_csv(), index = False)
@@ -49,13 +82,22 @@ class USASpendingTransactions:
     def combine_transactions(self):
         """Combine all of the transactions in the data folder."""
         transaction_folder = self.downloads_folder()
-        out = {}
+        frames = []
         for file in transaction_folder.rglob("*.csv"):
             print(file)
-            df = pd.read_csv(file, index_col = None)
-            for i, row in df.iterrows():
-                out[row["internal_id"]] = row
-        df = pd.DataFrame(out.values())
+            frames.append(pd.read_csv(file, index_col = None, dtype = self.page_dtypes))
+        # stack all of the pages at once instead of building a row at a time
+        df = pd.concat(frames, ignore_index = True)
+        pages = np.repeat(np.arange(len(frames)), [len(frame) for frame in frames])
+        # the same transaction can show up on more than one page. keep its last row, in the spot where it first showed up
+        first_seen = df.groupby("internal_id", sort = False).ngroup()
+        df = df[~df["internal_id"].duplicated(keep = "last")]
+        df = df.iloc[first_seen[df.index].argsort()]
+        # only keep the columns from pages that still have rows, in the order those pages list them
+        columns = {}
+        for page in pd.unique(pages[df.index]):
+            columns.update(dict.fromkeys(frames[page].columns))
+        df = df[list(columns)]
         df.sort_values(by = "Action Date", inplace = True)
         df.to_csv(self.combined_csv(), index=False)
 
@@ -69,9 +111,9 @@ class USASpendingTransactions:
         return {
             "filters": {
                 "tas_codes": {"require": [[usaid_tas(year)]]},
-                "award_type_codes": ["A", "B", "C", "D", "02", "03", "04", "05", "06", "07", "08", "09", "10", "11", "IDV_A", "IDV_B", "IDV_B_A", "IDV_B_B", "IDV_B_C", "IDV_C", "IDV_D", "IDV_E"]
+                "award_type_codes": list(_TRANSACTION_AWARD_TYPE_CODES)
             },
-            "fields": ["internal_id", "Action Date", "Action Type", "Assistance Listing", "Award ID", "Award Type", "Awarding Agency", "Awarding Sub Agency", "Funding Agency", "Funding Sub Agency", "Issued Date", "Last Date to Order", "Loan Value", "Mod", "NAICS", "PSC", "Primary Place of Performance", "Recipient Location", "Recipient Name", "Recipient UEI", "Subsidy Cost", "Transaction Amount", "Transaction Description"],
+            "fields": list(_TRANSACTION_SEARCH_FIELDS),
             "limit": 100,
             "page": page,
             "sort": "Action Date",
@@ -81,7 +123,24 @@ class USASpendingTransactions:
     def _year_page_transactions(self, year: int, page: int):
         url = SPENDING_BY_TRANSACTION
         kwargs = self._transaction_params(year, page)
-        res = requests.post(url, json = kwargs).json()
+
+        # use the page we saved if we asked for the exact same thing recently, e.g. if the last search failed partway through
+        cache_file = self.search_cache_folder() / f"{hashlib.sha1(json.dumps(kwargs, sort_keys = True).encode()).hexdigest()}.json"
+        # a critical download date means we want results from after it, so pages saved before it don't count, no matter how recent
+        if cache_is_fresh(cache_file, self.search_cache_seconds, self.critical_download_date):
+            with open(cache_file) as f:
+                res = json.load(f)
+        else:
+            # ask the API for the page, once it's our turn. the session retries on its own when the API is busy
+            self._search_rate.wait()
+            retval = self.session.post(url, json = kwargs)
+            # raise an error if the lookup still failed, instead of failing later on a missing key
+            retval.raise_for_status()
+            res = retval.json()
+            # save the page
+            with atomic_file(cache_file) as temp_file, open(temp_file, "w") as f:
+                f.write(json.dumps({"results": res["results"], "page_metadata": res["page_metadata"]}))
+
         out = []
         for row in res["results"]:
             assistance_listing = row.pop("Assistance Listing")
@@ -96,6 +155,8 @@ class USASpendingTransactions:
             row["country_name"] = row.pop("Primary Place of Performance")["country_name"]
             row["recipient_country"] = row.pop("Recipient Location")["country_name"]
             out.append(row)
-        
-        pd.DataFrame(out).to_csv(self.downloads_folder() / f"{year}_p_{page}.csv", index = False)
         return res["page_metadata"]["hasNext"], out
+
+    def _save_page(self, year: int, page: int, rows: list[dict]):
+        """Save one page of search results to the downloads folder, so combine_transactions can put them back together later."""
+        pd.DataFrame(rows).to_csv(self.downloads_folder() / f"{year}_p_{page}.csv", index = False)
@@ -1,5 +1,12 @@
 from pathlib import Path
 from enum import Enum, auto
+import time
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
 
 DATA_FOLDER = Path(__file__).parent.parent / "data"
 SPENDING_BY_AWARD = "https://api.usaspending.gov/api/v2/search/spending_by_award/"
@@ -8,6 +15,86 @@ SPENDING_BY_TRANSACTION = "https://api.usaspending.gov/api/v2/search/spending_by
 AWARD_DOWNLOAD = "https://api.usaspending.gov/api/v2/download/contract"
 
 
+def api_session(pool_connections: int = 10, pool_maxsize: int = 20, retry_posts: bool = False) -> requests.Session:
+    """Make a session for talking to an API. The session reuses its connections instead of opening a new one for every request, and retries automatically when the API is busy.
+
+    Args:
+        pool_connections: the number of hosts to keep connections open for
+        pool_maxsize: the number of connections to keep open for each host. use at least as many as the threads that share the session
+        retry_posts: also retry POST requests. only use this for read-only endpoints like searches. by default only requests that are safe to repeat (GET, HEAD...) are retried, so a timed out POST that starts a job on the server (like a download request) doesn't start it twice
+    """
+    session = requests.Session()
+    if retry_posts:
+        retries = Retry(total = 5, backoff_factor = 1, status_forcelist = [429, 502, 503, 504], allowed_methods = frozenset({"GET", "POST"}))
+    else:
+        retries = Retry(total = 5, backoff_factor = 1, status_forcelist = [429, 502, 503, 504])
+    session.mount("https://", HTTPAdapter(pool_connections = pool_connections, pool_maxsize = pool_maxsize, max_retries = retries))
+    return session
+
+
+class RateLimiter:
+    """Keeps requests that are sent from several threads from going over a rate limit. Each thread reserves the next open time slot, then sleeps until it comes, so requests can be in flight at the same time while still starting evenly spaced."""
+
+    def __init__(self, requests_per_second: float):
+        self.requests_per_second = requests_per_second
+        self._lock = threading.Lock()
+        self._next_time = 0.0
+
+    def wait(self) -> None:
+        """Wait until we can send another request."""
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_time)
+            self._next_time = start + 1 / self.requests_per_second
+        time.sleep(start - now)
+
+
+@contextmanager
+def atomic_file(file: Path):
+    """Write a file by writing a temporary file next to it and then swapping it in, so a crash never leaves a half-written file. Use it like this:
+
+        with atomic_file(file) as temp_file:
+            (write everything to temp_file)
+    """
+    temp_file = file.with_name(file.name + ".tmp")
+    try:
+        yield temp_file
+        temp_file.replace(file)
+    finally:
+        # if the write failed, don't leave the temporary file behind
+        temp_file.unlink(missing_ok = True)
+
+
+def cache_is_fresh(file: Path, max_age_seconds: float, not_before: datetime | None = None) -> bool:
+    """True if a saved file exists and is recent enough to use instead of asking the API again.
+
+    Args:
+        file: the saved file
+        max_age_seconds: the oldest the file can be
+        not_before: if given, the file also has to be saved after this time, e.g. a critical download date that asks for fresh data
+    """
+    if not file.exists():
+        return False
+    saved = file.stat().st_mtime
+    if time.time() - saved >= max_age_seconds:
+        return False
+    if not_before is not None and datetime.fromtimestamp(saved) < not_before:
+        return False
+    return True
+
+
+def clear_stale_files(folder: Path, max_age_seconds: float) -> None:
+    """Delete the files in a cache folder that are too old to use. Saved files only get replaced when we ask for the exact same thing again, so without this the folder would keep growing."""
+    oldest = time.time() - max_age_seconds
+    for file in folder.iterdir():
+        try:
+            if file.stat().st_mtime < oldest:
+                file.unlink()
+        except FileNotFoundError:
+            # someone else already deleted it
+            pass
+
+
 class AwardType(Enum):
     """USASpending divides their data by award type, and they format the data for each award slightly differently when searching for awards. Use this class as an input to specify what kind of award you're looking for."""
     CONTRACT = auto()
@@ -17,22 +104,18 @@ class AwardType(Enum):
     DIRECT_PAYMENTS = auto()
     OTHER = auto()
 
+_AWARD_TYPE_CODES: dict[AwardType, tuple[str, ...]] = {
+    AwardType.CONTRACT: ("A", "B", "C", "D"),
+    AwardType.IDV: ("IDV_A", "IDV_B", "IDV_B_A", "IDV_B_B", "IDV_B_C", "IDV_C", "IDV_D", "IDV_E"),
+    AwardType.LOAN: ("07", "08"),
+    AwardType.GRANT: ("02", "03", "04", "05"),
+    AwardType.DIRECT_PAYMENTS: ("06", "10"),
+    AwardType.OTHER: ("09", "11", "-1"),
+}
+
 def award_type_codes(award_type: AwardType) -> list[str]:
     """Get the eligible award type codes for the given award type. We have to provide these to the USASpending API to tell them what kinds of awards we're looking for."""
-    if award_type == AwardType.CONTRACT:
-        return ["A", "B", "C", "D"]
-    elif award_type == AwardType.IDV:
-        return ["IDV_A", "IDV_B", "IDV_B_A", "IDV_B_B", "IDV_B_C", "IDV_C", "IDV_D", "IDV_E"]
-    elif award_type == AwardType.LOAN:
-        return ["07", "08"]
-    elif award_type == AwardType.GRANT:
-        return ["02", "03", "04", "05"]
-    elif award_type == AwardType.DIRECT_PAYMENTS:
-        return ["06", "10"]
-    elif award_type == AwardType.OTHER:
-        return ["09", "11", "-1"]
-    else:
-        return []
+    return list(_AWARD_TYPE_CODES.get(award_type, ()))
     
 def program_activity_codes() -> dict:
     return {